@@ -0,0 +1,14 @@
+-- One-time DDL for the boston_cocktails staging table.
+-- ingredient_number is text; materialize it as an integer (NULL when not
+-- purely numeric) so scripts/migration/migrate_sources.py can sort on a
+-- plain indexed column. Run once after loading the staging table; the
+-- importer falls back to casting inline when this column is absent.
+
+ALTER TABLE boston_cocktails
+    ADD COLUMN ingredient_order INT
+    GENERATED ALWAYS AS (
+        CASE WHEN ingredient_number ~ '^\d+$' THEN ingredient_number::int END
+    ) STORED;
+
+CREATE INDEX boston_cocktails_name_order_idx
+    ON boston_cocktails(name, ingredient_order);
@@ -12,6 +12,8 @@ Goals:
 Datasets handled:
 - the_cocktail_db (columns: drink, category, glass, iba, ingredient_order, ingredient, measure, ...)
 - boston_cocktails (columns: name, category, ingredient_number, ingredient, measure)
+  Sorts on a generated integer ingredient_order column when present; see
+  boston-cocktails-ingredient-order.sql for the one-time DDL.
 
 Usage:
   python3 scripts/migration/migrate_sources.py --source both [--limit N] [--dry-run]
@@ -22,7 +24,10 @@ Env overrides (optional):
 Notes:
   - Measurements are stored free-form in cocktail_ingredient.quantity
   - Ingredient order preserved via cocktail_ingredient.ingredient_order
-  - Glass names are title-cased and inserted lazily in glass_type
+  - Glass names are title-cased; missing ones are inserted into glass_type
+    up front in one batch per import
+  - Ingredient names are resolved the same way: missing names are inserted
+    into ingredient in one batch, then looked up from an in-memory map
 
 # Reason: Keep migration logic explicit, avoid ORM overhead, and ensure
 # predictable SQL-level conflict handling for idempotency.
@@ -37,6 +42,36 @@ from typing import Dict, Iterable, List, Optional, Tuple
 import psycopg2
 import psycopg2.extras
 
+# Rows per multi-row INSERT; PostgreSQL throughput levels off around here.
+BATCH_SIZE = 1000
+
+# work_mem for the import transaction (staging sorts and aggregates).
+STAGING_WORK_MEM = "64MB"
+
+# Multi-row templates for execute_values; %s expands to the VALUES list.
+UPSERT_COCKTAILS_SQL = """
+    INSERT INTO cocktail(name, source, category, glass_type_id, description, instructions)
+    VALUES %s
+    ON CONFLICT (name, source)
+    DO UPDATE SET
+        category = EXCLUDED.category,
+        glass_type_id = COALESCE(EXCLUDED.glass_type_id, cocktail.glass_type_id),
+        description = COALESCE(EXCLUDED.description, cocktail.description),
+        instructions = COALESCE(EXCLUDED.instructions, cocktail.instructions)
+    RETURNING name, id
+"""
+
+UPSERT_COCKTAIL_INGREDIENTS_SQL = """
+    INSERT INTO cocktail_ingredient(
+        cocktail_id, ingredient_id, quantity, ingredient_order, source_dataset
+    ) VALUES %s
+    ON CONFLICT (cocktail_id, ingredient_id)
+    DO UPDATE SET
+        quantity = EXCLUDED.quantity,
+        ingredient_order = EXCLUDED.ingredient_order,
+        source_dataset = EXCLUDED.source_dataset
+"""
+
 
 @dataclass
 class DBConfig:
@@ -66,85 +101,111 @@ def title_case(s: Optional[str]) -> Optional[str]:
     return s.title() if s else None
 
 
-def get_or_create_glass(cur, name: Optional[str]) -> Optional[int]:
-    if not name:
+def fetch_name_ids(cur, table: str) -> Dict[str, int]:
+    """Return the name -> id map for a lookup table (glass_type, ingredient)."""
+    cur.execute(f"SELECT name, id FROM {table}")
+    return dict(cur.fetchall())
+
+
+def ensure_names(cur, table: str, names: Iterable[str], ids: Dict[str, int]) -> None:
+    """
+    Insert names missing from ``ids`` into a lookup table in one batch.
+
+    ``ids`` is updated in place so callers can resolve names with plain dict
+    lookups instead of a SELECT/INSERT round-trip per row.
+    """
+    missing = sorted({n for n in names if n} - ids.keys())
+    if not missing:
+        return
+    rows = psycopg2.extras.execute_values(
+        cur,
+        f"INSERT INTO {table}(name) VALUES %s ON CONFLICT (name) DO NOTHING RETURNING name, id",
+        [(n,) for n in missing],
+        fetch=True,
+    )
+    ids.update(rows)
+    # Reason: DO NOTHING returns no row for names another session inserted
+    # after our prefetch, so pick those up explicitly.
+    unresolved = [n for n in missing if n not in ids]
+    if unresolved:
+        cur.execute(f"SELECT name, id FROM {table} WHERE name = ANY(%s)", (unresolved,))
+        ids.update(cur.fetchall())
+
+
+def normalize_ingredient(name: Optional[str]) -> Optional[str]:
+    if name is None:
         return None
-    norm = title_case(name)
-    cur.execute("SELECT id FROM glass_type WHERE name = %s", (norm,))
-    row = cur.fetchone()
-    if row:
-        return row[0]
-    cur.execute("INSERT INTO glass_type(name) VALUES (%s) RETURNING id", (norm,))
-    return cur.fetchone()[0]
+    return name.strip() or None
 
 
-def get_or_create_ingredient(cur, name: str) -> int:
-    key = name.strip()
-    if not key:
-        raise ValueError("ingredient name cannot be empty")
-    cur.execute("SELECT id FROM ingredient WHERE name = %s", (key,))
-    row = cur.fetchone()
-    if row:
-        return row[0]
-    cur.execute("INSERT INTO ingredient(name) VALUES (%s) RETURNING id", (key,))
-    return cur.fetchone()[0]
-
-
-def upsert_cocktail(
-    cur,
-    *,
-    name: str,
-    source: str,
-    category: Optional[str],
-    glass: Optional[str],
-    description: Optional[str] = None,
-    instructions: Optional[str] = None,
-) -> int:
-    glass_id = get_or_create_glass(cur, glass)
-    # Use ON CONFLICT on (name, source)
-    cur.execute(
-        """
-        INSERT INTO cocktail(name, source, category, glass_type_id, description, instructions)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        ON CONFLICT (name, source)
-        DO UPDATE SET
-            category = EXCLUDED.category,
-            glass_type_id = COALESCE(EXCLUDED.glass_type_id, cocktail.glass_type_id),
-            description = COALESCE(EXCLUDED.description, cocktail.description),
-            instructions = COALESCE(EXCLUDED.instructions, cocktail.instructions)
-        RETURNING id
-        """,
-        (name, source, category, glass_id, description, instructions),
+def upsert_cocktails(cur, rows: List[Tuple]) -> Dict[str, int]:
+    """
+    Upsert cocktails for one source in batches and return their name -> id map.
+
+    ``rows`` are (name, source, category, glass_type_id, description,
+    instructions) with names unique within the list. DO UPDATE makes RETURNING
+    yield existing rows too, so every name is resolved without a follow-up
+    lookup or a round-trip per cocktail.
+    """
+    if not rows:
+        return {}
+    returned = psycopg2.extras.execute_values(
+        cur, UPSERT_COCKTAILS_SQL, rows, page_size=BATCH_SIZE, fetch=True
     )
-    return cur.fetchone()[0]
-
-
-def upsert_cocktail_ingredient(
-    cur,
-    *,
-    cocktail_id: int,
-    ingredient_id: int,
-    quantity: Optional[str],
-    order_index: Optional[int],
-    source_dataset: Optional[str],
-):
-    cur.execute(
-        """
-        INSERT INTO cocktail_ingredient(
-            cocktail_id, ingredient_id, quantity, ingredient_order, source_dataset
-        ) VALUES (%s, %s, %s, %s, %s)
-        ON CONFLICT (cocktail_id, ingredient_id)
-        DO UPDATE SET
-            quantity = EXCLUDED.quantity,
-            ingredient_order = EXCLUDED.ingredient_order,
-            source_dataset = EXCLUDED.source_dataset
-        """,
-        (cocktail_id, ingredient_id, quantity, order_index, source_dataset),
+    return dict(returned)
+
+
+def upsert_cocktail_ingredients(cur, batch: Dict[Tuple[int, int], Tuple]) -> None:
+    """
+    Flush buffered cocktail_ingredient rows with one multi-row upsert.
+
+    ``batch`` maps (cocktail_id, ingredient_id) to
+    (cocktail_id, ingredient_id, quantity, order_index, source_dataset) and is
+    cleared afterwards. Keying by the primary key keeps the last occurrence of
+    a repeated ingredient, matching the previous row-by-row upsert, and avoids
+    ON CONFLICT touching the same row twice in one statement.
+    """
+    if not batch:
+        return
+    psycopg2.extras.execute_values(
+        cur,
+        UPSERT_COCKTAIL_INGREDIENTS_SQL,
+        list(batch.values()),
+        page_size=BATCH_SIZE,
     )
+    batch.clear()
 
 
 # --- Importers ----------------------------------------------------------
 
+# Fallback when boston_cocktails has no generated ingredient_order column
+BOSTON_ORDER_CAST = (
+    "CASE WHEN ingredient_number ~ '^\\d+$' THEN ingredient_number::int ELSE NULL END"
+)
+
+
+def boston_order_expr(cur) -> str:
+    """
+    Return the SQL expression for boston_cocktails ingredient order.
+
+    Uses the generated ingredient_order column created by
+    boston-cocktails-ingredient-order.sql when it exists; otherwise (including
+    a plain, non-generated column of that name) casts ingredient_number inline.
+    """
+    cur.execute(
+        """
+        SELECT is_generated FROM information_schema.columns
+        WHERE table_schema = current_schema()
+          AND table_name = 'boston_cocktails'
+          AND column_name = 'ingredient_order'
+        """
+    )
+    row = cur.fetchone()
+    if row and row[0] == "ALWAYS":
+        return "ingredient_order"
+    return BOSTON_ORDER_CAST
+
+
 def import_the_cocktail_db(cur, *, limit: Optional[int] = None) -> Tuple[int, int, int, int]:
     """
     Import cocktails from the_cocktail_db staging table.
@@ -163,44 +224,57 @@ def import_the_cocktail_db(cur, *, limit: Optional[int] = None) -> Tuple[int, in
     )
     drinks = cur.fetchall()
 
-    created = 0
+    # Resolve every glass and ingredient name up front so the loop below only
+    # does dict lookups.
+    glass_ids = fetch_name_ids(cur, "glass_type")
+    ensure_names(cur, "glass_type", (title_case(glass) for _, glass, _ in drinks), glass_ids)
+    ingredient_ids = fetch_name_ids(cur, "ingredient")
+    cur.execute(
+        "SELECT DISTINCT ingredient FROM the_cocktail_db WHERE ingredient IS NOT NULL"
+        + (" AND drink = ANY(%s)" if limit else ""),
+        (([drink for drink, _, _ in drinks],) if limit else None),
+    )
+    ensure_names(
+        cur, "ingredient", (normalize_ingredient(n) for (n,) in cur.fetchall()), ingredient_ids
+    )
+
     skipped = 0
     rels = 0
     conflicts = 0  # retained for parity in summary
 
-    for (drink_name, glass, category) in drinks:
-        cocktail_id = upsert_cocktail(
-            cur,
-            name=drink_name,
-            source="the_cocktail_db",
-            category=category,
-            glass=glass,
-        )
-        created += 1
-        # Load ingredients for this drink ordered by ingredient_order
-        cur.execute(
-            """
-            SELECT ingredient_order, ingredient, measure
-            FROM the_cocktail_db
-            WHERE drink = %s AND ingredient IS NOT NULL
-            ORDER BY ingredient_order NULLS LAST
-            """,
-            (drink_name,),
+    cocktail_ids = upsert_cocktails(
+        cur,
+        [
+            (drink, "the_cocktail_db", category, glass_ids.get(title_case(glass)), None, None)
+            for drink, glass, category in drinks
+        ],
+    )
+    created = len(cocktail_ids)
+
+    # Stream every ingredient row in one ordered scan instead of one SELECT
+    # per cocktail; ids are resolved from the maps built above.
+    relations: Dict[Tuple[int, int], Tuple] = {}
+    with cur.connection.cursor(name="tcd_stream") as scur:
+        scur.execute(
+            "SELECT drink, ingredient_order, ingredient, measure FROM the_cocktail_db "
+            "WHERE ingredient IS NOT NULL"
+            + (" AND drink = ANY(%s)" if limit else "")
+            + " ORDER BY drink, ingredient_order NULLS LAST",
+            ((list(cocktail_ids),) if limit else None),
         )
-        for order_idx, ingredient_name, measure in cur.fetchall():
-            try:
-                ing_id = get_or_create_ingredient(cur, ingredient_name)
-            except ValueError:
+        for drink_name, order_idx, ingredient_name, measure in scur:
+            key = normalize_ingredient(ingredient_name)
+            if not key:
                 continue
-            upsert_cocktail_ingredient(
-                cur,
-                cocktail_id=cocktail_id,
-                ingredient_id=ing_id,
-                quantity=measure,
-                order_index=order_idx,
-                source_dataset="the_cocktail_db",
+            cocktail_id = cocktail_ids[drink_name]
+            ing_id = ingredient_ids[key]
+            relations[(cocktail_id, ing_id)] = (
+                cocktail_id, ing_id, measure, order_idx, "the_cocktail_db"
             )
             rels += 1
+            if len(relations) >= BATCH_SIZE:
+                upsert_cocktail_ingredients(cur, relations)
+    upsert_cocktail_ingredients(cur, relations)
 
     return created, skipped, rels, conflicts
 
@@ -223,46 +297,54 @@ def import_boston_cocktails(cur, *, limit: Optional[int] = None) -> Tuple[int, i
     )
     names = cur.fetchall()
 
-    created = 0
+    ingredient_ids = fetch_name_ids(cur, "ingredient")
+    cur.execute(
+        "SELECT DISTINCT ingredient FROM boston_cocktails WHERE ingredient IS NOT NULL"
+        + (" AND name = ANY(%s)" if limit else ""),
+        (([name for name, _ in names],) if limit else None),
+    )
+    ensure_names(
+        cur, "ingredient", (normalize_ingredient(n) for (n,) in cur.fetchall()), ingredient_ids
+    )
+
     skipped = 0
     rels = 0
     conflicts = 0
 
-    for (name, category) in names:
-        cocktail_id = upsert_cocktail(
-            cur,
-            name=name,
-            source="boston_cocktails",
-            category=category,
-            glass=None,  # not provided in this dataset
-        )
-        created += 1
-        # Ingredients ordered by ingredient_number (text -> int where possible)
-        cur.execute(
-            """
-            SELECT CASE WHEN ingredient_number ~ '^\\d+$' THEN ingredient_number::int ELSE NULL END AS order_idx,
-                   ingredient,
-                   measure
-            FROM boston_cocktails
-            WHERE name = %s AND ingredient IS NOT NULL
-            ORDER BY order_idx NULLS LAST
-            """,
-            (name,),
+    cocktail_ids = upsert_cocktails(
+        cur,
+        [
+            # glass not provided in this dataset
+            (name, "boston_cocktails", category, None, None, None)
+            for name, category in names
+        ],
+    )
+    created = len(cocktail_ids)
+
+    # Single ordered scan; prefer the precomputed integer ingredient_order
+    order_expr = boston_order_expr(cur)
+    relations: Dict[Tuple[int, int], Tuple] = {}
+    with cur.connection.cursor(name="boston_stream") as scur:
+        scur.execute(
+            f"SELECT name, {order_expr} AS order_idx, ingredient, measure "
+            "FROM boston_cocktails WHERE ingredient IS NOT NULL"
+            + (" AND name = ANY(%s)" if limit else "")
+            + " ORDER BY name, order_idx NULLS LAST",
+            ((list(cocktail_ids),) if limit else None),
         )
-        for order_idx, ingredient_name, measure in cur.fetchall():
-            try:
-                ing_id = get_or_create_ingredient(cur, ingredient_name)
-            except ValueError:
+        for name, order_idx, ingredient_name, measure in scur:
+            key = normalize_ingredient(ingredient_name)
+            if not key:
                 continue
-            upsert_cocktail_ingredient(
-                cur,
-                cocktail_id=cocktail_id,
-                ingredient_id=ing_id,
-                quantity=measure,
-                order_index=order_idx,
-                source_dataset="boston_cocktails",
+            cocktail_id = cocktail_ids[name]
+            ing_id = ingredient_ids[key]
+            relations[(cocktail_id, ing_id)] = (
+                cocktail_id, ing_id, measure, order_idx, "boston_cocktails"
             )
             rels += 1
+            if len(relations) >= BATCH_SIZE:
+                upsert_cocktail_ingredients(cur, relations)
+    upsert_cocktail_ingredients(cur, relations)
 
     return created, skipped, rels, conflicts
 
@@ -289,6 +371,10 @@ def main():
     cur = conn.cursor()
 
     try:
+        # Whole run is one transaction; give the GROUP BY / ORDER BY staging
+        # scans room to sort in memory instead of spilling to disk.
+        cur.execute("SET LOCAL work_mem = %s", (STAGING_WORK_MEM,))
+
         totals: Dict[str, Tuple[int, int, int, int]] = {}
 
         if args.source in ("the_cocktail_db", "both"):